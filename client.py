@@ -1,11 +1,35 @@
 from rpc import RPCClient
 
+# Commands the REPL forwards to the server
+_COMMANDS = frozenset({
+    "set", "get", "delete", "append", "keys", "flushall",
+    "expire", "ttl", "persist", "exists",
+    "hset", "hget", "hdel", "hgetall", "hdelall",
+    "zset", "zrange", "zrevrange", "zdelvalue", "zdelkey", "zrank", "zgetall",
+    "lpush", "rpush", "lpop", "rpop", "lrange", "llen", "delpush",
+})
+
+def format_result(cmd, result):
+    # Handle special TTL cases
+    if cmd == "ttl":
+        if result == -2:
+            return "Key does not exist."
+        elif result == -1:
+            return "Key exists but has no expiration."
+    return result
+
 def main():
     print("Redis Clone Client")
     print("Type your commands (e.g., `SET key value`) or type `EXIT` to quit.")
+    print("Type `PIPELINE` to queue commands and `EXEC` to send them in one round-trip.")
 
     client = RPCClient('127.0.0.1', 8080)
     client.connect()
+    # Resolve each remote method once instead of through __getattr__ per command
+    dispatch = {name: getattr(client, name) for name in _COMMANDS}
+
+    # Commands queued after PIPELINE, None when not pipelining
+    pipeline = None
 
     try:
         while True:
@@ -25,28 +49,29 @@ def main():
                 cmd = "delete"
 
             try:
-                if cmd in ["set", "get", "delete", "append", "keys", "flushall", 
-                          "expire", "ttl", "persist", "exists", 
-                          "hset", "hget", "hdel", "hgetall", "hdelall",
-                           "zset",  "zrange", "zrevrange", "zdelvalue", "zdelkey", "zrank", "zgetall",
-                            "lpush", "rpush", "lpop", "rpop", "lrange", "llen", "delpush",
-                          ]:
+                if cmd == "pipeline":
+                    pipeline = []
+                    print("OK")
+                elif cmd == "exec":
+                    if pipeline is None:
+                        print("EXEC without PIPELINE.")
+                        continue
+                    results = client.execute_batch(pipeline)
+                    for (queued_cmd, _), result in zip(pipeline, results):
+                        print(format_result(queued_cmd, result))
+                    pipeline = None
+                elif cmd in _COMMANDS:
                     if cmd == "set" and len(args) >= 4 and args[-2].lower() == "ex":
-                        key, value = args[0], args[1]
-                        ex = int(args[-1])
-                        result = client.set(key, value, ex=ex)
-                    else:
-                        method = getattr(client, cmd)
-                        result = method(*args)
-
-                    # Handle special TTL cases
-                    if cmd == "ttl":
-                        if result == -2:
-                            result= "Key does not exist."
-                        elif result == -1:
-                            result="Key exists but has no expiration."
-                        
-                    print(result)
+                        args = [args[0], args[1], int(args[-1])]
+
+                    if pipeline is not None:
+                        pipeline.append((cmd, args))
+                        print("QUEUED")
+                        continue
+
+                    result = dispatch[cmd](*args)
+
+                    print(format_result(cmd, result))
                 else:
                     print("Unknown command.")
             except Exception as e:
@@ -96,4 +121,10 @@ if __name__ == "__main__":
 # rpop alphabet           -> c   
 # lpop alphabet           -> d
 # lpop alphabet            -> e
-# delpush alphabet      ->Success
\ No newline at end of file
+# delpush alphabet      ->Success
+
+# Pipelining
+# pipeline               -> start queueing commands
+# set a 1                -> QUEUED
+# get a                  -> QUEUED
+# exec                   -> OK, 1 (all replies in one round-trip)
\ No newline at end of file
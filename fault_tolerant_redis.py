@@ -1,32 +1,93 @@
 from rpc import RPCServer
 import threading
 import time
+import pickle
 import json
 import os
+import copy
+import inspect
+import heapq
 from typing import Any, Dict, List, Optional
 import logging
-from collections import defaultdict
+import queue
+import atexit
+from logging.handlers import QueueHandler, QueueListener
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from itertools import islice
+from math import inf, isfinite
+from operator import itemgetter
+from sortedcontainers import SortedList
+
+logger = logging.getLogger(__name__)
+
+DELTA_RATIO = 0.2  # Write a full base once this fraction of keys changed
+MAX_DELTAS = 10  # Write a full base after this many deltas
+
+SNAPSHOT_BUFFER = 1 << 20  # Snapshot file buffer size, cuts write/read syscalls
+
+TTL_HOT_WINDOW = 60  # Seconds of deadlines kept in the heap, later ones wait in per-window buckets
+
+_MISSING = object()  # Default for dict lookups where None is a valid value
+
+class RHash(dict):
+    """Value type of a hash key."""
+    __slots__ = ()
+
+class RList(deque):
+    """Value type of a list key."""
+    __slots__ = ()
 
 class FaultTolerantRedisClone:
-    def __init__(self, snapshot_interval: int = 30, snapshot_file: str = "redis_snapshot.json"):
+    def __init__(self, snapshot_interval: int = 30, snapshot_file: str = "redis_snapshot.pkl",
+                 num_shards: int = 16):
         self.data_store: Dict[str, Any] = {}
-        self.sorted_sets: Dict[str, List[tuple]] = {} 
-        self.expiry_times: Dict[str, float] = {} 
-        self.lock = threading.RLock()  # Reentrant lock for thread safety
-        self.lock_list = threading.Lock()
+        self.sorted_sets: Dict[str, SortedList] = {}  # (score, value) pairs kept in order
+        self.zset_scores: Dict[str, Dict[Any, float]] = {}  # value -> score for each sorted set
+        self.expiry_times: Dict[str, float] = {}  # time.monotonic() deadlines
+        # Reentrant locks for thread safety, one per stripe of the key space
+        self._locks = [threading.RLock() for _ in range(num_shards)]
+        self._ttl_heap: List[tuple] = []  # (expire_at, key) min-heap of near deadlines, may hold stale entries
+        # Far deadlines as window index -> [(expire_at, key)], moved into the heap as their window approaches
+        self._ttl_buckets: Dict[int, List[tuple]] = {}
+        self._ttl_bucket_entries = 0
+        self._ttl_next_bucket = int(time.monotonic() // TTL_HOT_WINDOW) + 2  # First window not yet in the heap
+        self._expiry_changed = threading.Condition(threading.Lock())  # Guards the heap and buckets, wakes the cleanup thread
         self.snapshot_interval = snapshot_interval
         self.snapshot_file = snapshot_file
-        self.last_snapshot_time = time.time()
+        self.last_snapshot_time = time.monotonic()
+        self._snapshot_pid: Optional[int] = None  # Forked child writing a snapshot
+        self._snapshot_lock = threading.Lock()  # Guards _snapshot_pid, taken after the stripe locks
+        self._snapshot_pending_base: Optional[int] = None  # Seq of the base the child is writing
+        # Incremental snapshots: keys changed since the last snapshot, written as deltas
+        self._dirty: set = set()
+        self._dirty_zsets: set = set()
+        self._snapshot_seq = 0  # Last sequence number handed out to a base or delta
+        self._base_seq = 0  # Sequence number of the published base snapshot
+        self._deltas_since_base = 0
+        self._force_full = True  # Next snapshot must be a full base
+        self._rotate_base = True  # False after loading from .prev, so a bad snapshot_file is not kept over it
         
-        # Set up logging
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            filename='redis_clone.log'
-        )
+        # Set up logging: commands only enqueue records, a listener thread writes the file
+        root_logger = logging.getLogger()
+        if not root_logger.handlers:
+            file_handler = logging.FileHandler('redis_clone.log')
+            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            log_queue = queue.SimpleQueue()
+            self._log_listener = QueueListener(log_queue, file_handler)
+            self._log_listener.start()
+            atexit.register(self._log_listener.stop)
+            root_logger.addHandler(QueueHandler(log_queue))
+            root_logger.setLevel(logging.INFO)
         
         # Load existing data if available
         self._load_snapshot()
+
+        # Command table used by execute_batch
+        self._commands = {
+            name: method for name, method in inspect.getmembers(self, predicate=inspect.ismethod)
+            if not name.startswith('_') and name != 'execute_batch'
+        }
         
         # Xử lí key hết hạn 
         self.cleanup_thread = threading.Thread(target=self._cleanup_expired_keys, daemon=True)
@@ -36,276 +97,654 @@ class FaultTolerantRedisClone:
         self.snapshot_thread = threading.Thread(target=self._periodic_snapshot, daemon=True)
         self.snapshot_thread.start()
 
+    # GET, EXISTS, TTL and HGET read without a stripe lock: every lookup they make is a
+    # single dict read, which is atomic under the GIL. A key that looks expired is checked
+    # again under its stripe lock before removal, since a writer may have refreshed it.
+    def _lock_for(self, key: Any) -> threading.RLock:
+        """Return the lock guarding the stripe that key belongs to."""
+        locks = self._locks
+        return locks[hash(key) % len(locks)]
+
+    @contextmanager
+    def _locked(self, indices):
+        """Hold the stripe locks at the given indices, taken in ascending order to avoid deadlocks."""
+        locks = [self._locks[i] for i in sorted(indices)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _all_locks(self):
+        """Hold every stripe lock, for operations spanning the whole key space."""
+        return self._locked(range(len(self._locks)))
+
+    @staticmethod
+    def _rank_range(length: int, start: int, end: int) -> tuple:
+        """Turn inclusive, possibly negative rank bounds into a (start, stop) slice."""
+        if start < 0:
+            start = max(length + start, 0)
+        if end < 0:
+            end = length + end
+        return start, max(min(end, length - 1) + 1, start)
+
+    def _set_expiry(self, key: str, expire_at: float) -> None:
+        """Record a key's expiry time. Caller must hold the key's stripe lock."""
+        self.expiry_times[key] = expire_at
+        heap = self._ttl_heap
+        expiry_changed = self._expiry_changed
+        with expiry_changed:
+            if expire_at >= self._ttl_next_bucket * TTL_HOT_WINDOW:
+                # Long TTL, parked until the cleanup thread promotes its window
+                self._ttl_buckets.setdefault(int(expire_at // TTL_HOT_WINDOW), []).append((expire_at, key))
+                self._ttl_bucket_entries += 1
+                return
+            heapq.heappush(heap, (expire_at, key))
+            if heap[0] == (expire_at, key):
+                # The cleanup thread is sleeping until a later deadline
+                expiry_changed.notify()
+
+    def _index_expiry(self) -> None:
+        """Rebuild the heap and buckets from expiry_times on load. Caller must hold _expiry_changed."""
+        horizon = self._ttl_next_bucket * TTL_HOT_WINDOW
+        heap = []
+        buckets = {}
+        for k, t in self.expiry_times.items():
+            if t < horizon:
+                heap.append((t, k))
+            else:
+                buckets.setdefault(int(t // TTL_HOT_WINDOW), []).append((t, k))
+        heapq.heapify(heap)
+        self._ttl_heap[:] = heap
+        self._ttl_buckets = buckets
+        self._ttl_bucket_entries = len(self.expiry_times) - len(heap)
+
     def _cleanup_expired_keys(self):
-        """Remove keys that have expired."""
+        """Remove keys that have expired, sleeping until the earliest TTL is due."""
+        data_store = self.data_store
+        expiry_times = self.expiry_times
+        heap = self._ttl_heap
+        expiry_changed = self._expiry_changed
         while True:
-            time.sleep(1)  # Check every second
-            with self.lock:
-                current_time = time.time()
-                expired_keys = [
-                    key for key, expire_time in self.expiry_times.items()
-                    if expire_time <= current_time
-                ]
-                for key in expired_keys:
-                    self.data_store.pop(key, None)
-                    self.expiry_times.pop(key, None)
-                    logging.info(f"Key expired and removed: {key}")
+            with expiry_changed:
+                current_time = time.monotonic()
+                # Keep at least one window of deadlines ahead in the heap
+                while self._ttl_next_bucket * TTL_HOT_WINDOW <= current_time + TTL_HOT_WINDOW:
+                    bucket = self._ttl_buckets.pop(self._ttl_next_bucket, ())
+                    self._ttl_bucket_entries -= len(bucket)
+                    for t, k in bucket:
+                        if expiry_times.get(k) == t:
+                            heapq.heappush(heap, (t, k))
+                    self._ttl_next_bucket += 1
+                due = []
+                while heap and heap[0][0] <= current_time:
+                    due.append(heapq.heappop(heap))
+                if not due:
+                    if len(heap) + self._ttl_bucket_entries > 2 * len(expiry_times) + 64:
+                        # Too many stale entries, keep only those still matching a live TTL
+                        heap[:] = [(t, k) for t, k in heap if expiry_times.get(k) == t]
+                        heapq.heapify(heap)
+                        buckets = self._ttl_buckets
+                        for index in list(buckets):
+                            buckets[index] = [(t, k) for t, k in buckets[index] if expiry_times.get(k) == t]
+                        self._ttl_bucket_entries = sum(map(len, buckets.values()))
+                    # Wake for the earliest deadline or the next window promotion
+                    wake_at = (self._ttl_next_bucket - 1) * TTL_HOT_WINDOW
+                    if heap and heap[0][0] < wake_at:
+                        wake_at = heap[0][0]
+                    expiry_changed.wait(max(0, wake_at - current_time))
+                    continue
+            # The heap lock is released before taking stripe locks
+            for expire_time, key in due:
+                with self._lock_for(key):
+                    # Entries overwritten by SET/EXPIRE/PERSIST no longer match
+                    if expiry_times.get(key) == expire_time:
+                        data_store.pop(key, None)
+                        del expiry_times[key]
+                        self._dirty.add(key)
+                        logger.info("Key expired and removed: %s", key)
+
+    def _delta_files(self) -> List[tuple]:
+        """Return (seq, path) for every delta file on disk, oldest first."""
+        directory = os.path.dirname(self.snapshot_file) or '.'
+        prefix = os.path.basename(self.snapshot_file) + '.delta.'
+        deltas = []
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                deltas.append((int(name[len(prefix):]), os.path.join(directory, name)))
+        return sorted(deltas)
 
     def _load_snapshot(self) -> None:
-        """Load data from snapshot file if it exists."""
+        """Load the latest base snapshot and replay the deltas written after it."""
+        deltas = []
+        applied = 0
+        try:
+            base_seq = None
+            # Fall back to the previous base if the latest one is missing or unreadable
+            for path in (self.snapshot_file, self.snapshot_file + ".prev"):
+                if not os.path.exists(path):
+                    continue
+                try:
+                    with open(path, 'rb', buffering=SNAPSHOT_BUFFER) as f:
+                        snapshot_data = pickle.load(f)
+                except Exception as e:
+                    logger.error("Error loading snapshot %s: %s", path, e)
+                    continue
+                self.data_store = {k: self._restore_value(v) for k, v in snapshot_data.get('data', {}).items()}
+                self.expiry_times = self._restore_expiry(snapshot_data)
+                self.sorted_sets = snapshot_data.get('sorted_sets', {})
+                base_seq = snapshot_data.get('seq', 0)
+                self._force_full = path != self.snapshot_file
+                self._rotate_base = path == self.snapshot_file
+                logger.info("Loaded snapshot from %s", path)
+                break
+            if base_seq is None:
+                base_seq = self._load_legacy_snapshot()
+
+            deltas = self._delta_files()
+            applied = base_seq or 0
+            if base_seq is not None:
+                for seq, path in deltas:
+                    if seq <= base_seq:
+                        continue
+                    if seq != applied + 1:
+                        break  # A missing delta breaks the chain
+                    try:
+                        with open(path, 'rb', buffering=SNAPSHOT_BUFFER) as f:
+                            delta = pickle.load(f)
+                    except Exception as e:
+                        # Later deltas build on this one, so the chain ends here
+                        logger.error("Error loading snapshot delta %s: %s", path, e)
+                        self._force_full = True
+                        break
+                    self._apply_delta(delta)
+                    applied = seq
+                self._base_seq = base_seq
+                self._deltas_since_base = applied - base_seq
+                logger.info("Replayed %s snapshot deltas", applied - base_seq)
+        except Exception as e:
+            logger.error("Error loading snapshot: %s", e)
+
+        # Never reuse a sequence number already on disk
+        self._snapshot_seq = max([applied] + [seq for seq, _ in deltas])
+        if self._snapshot_seq != applied:
+            self._force_full = True
+        # Index whatever was loaded, even after a failure part way through
+        with self._expiry_changed:
+            self._index_expiry()
+        self.zset_scores = {
+            k: {value: score for score, value in zset}
+            for k, zset in self.sorted_sets.items()
+        }
+
+    def _load_legacy_snapshot(self) -> Optional[int]:
+        """Load a JSON snapshot from before snapshots were pickled, returning 0 if one was found."""
+        path = os.path.splitext(self.snapshot_file)[0] + ".json"
+        if not os.path.exists(path):
+            return None
         try:
-            if os.path.exists(self.snapshot_file):
-                with open(self.snapshot_file, 'r') as f:
-                    snapshot_data = json.load(f)
-                    self.data_store = snapshot_data.get('data', {})
-                    self.expiry_times = {
-                        k: float(v) for k, v in snapshot_data.get('expiry', {}).items()
-                    }
-                    self.sorted_sets = snapshot_data.get('sorted_sets', {})
-                logging.info(f"Loaded snapshot from {self.snapshot_file}")
+            with open(path, 'r', buffering=SNAPSHOT_BUFFER) as f:
+                snapshot_data = json.load(f)
         except Exception as e:
-            logging.error(f"Error loading snapshot: {str(e)}")
+            logger.error("Error loading legacy snapshot %s: %s", path, e)
+            return None
+        # Lists were written as JSON arrays
+        self.data_store = {
+            k: RList(v) if type(v) is list else self._restore_value(v)
+            for k, v in snapshot_data.get('data', {}).items()
+        }
+        self.expiry_times = self._restore_expiry(snapshot_data)
+        self.sorted_sets = {
+            k: SortedList((float(score), value) for score, value in items)
+            for k, items in snapshot_data.get('sorted_sets', {}).items()
+        }
+        # Write it out as a pickled base on the next snapshot
+        self._force_full = True
+        logger.info("Loaded legacy snapshot from %s", path)
+        return 0
+
+    @staticmethod
+    def _restore_value(value: Any) -> Any:
+        """Convert plain deque and dict values from older snapshots to RList and RHash."""
+        value_type = type(value)
+        if value_type is deque:
+            return RList(value)
+        if value_type is dict:
+            return RHash(value)
+        return value
+
+    def _restore_expiry(self, snapshot_data: dict) -> Dict[str, float]:
+        """Rebase saved monotonic deadlines onto this process's monotonic clock."""
+        # Older snapshots stored wall-clock deadlines, which is an offset of 0
+        shift = snapshot_data.get('clock_offset', 0.0) - (time.time() - time.monotonic())
+        return {k: t + shift for k, t in snapshot_data.get('expiry', {}).items()}
+
+    def _apply_delta(self, delta: dict) -> None:
+        """Replay one delta snapshot on top of the loaded data."""
+        for key in delta['deleted']:
+            self.data_store.pop(key, None)
+            self.expiry_times.pop(key, None)
+        for key, value in delta['data'].items():
+            self.data_store[key] = self._restore_value(value)
+            self.expiry_times.pop(key, None)
+        self.expiry_times.update(self._restore_expiry(delta))
+        for key in delta['deleted_sorted_sets']:
+            self.sorted_sets.pop(key, None)
+        self.sorted_sets.update(delta['sorted_sets'])
+
+    def _snapshot_data(self, seq: int, dirty: Optional[set] = None, dirty_zsets: Optional[set] = None) -> dict:
+        """Collect a full snapshot, or only the given dirty keys for a delta."""
+        if dirty is None:
+            return {
+                'seq': seq,
+                'clock_offset': time.time() - time.monotonic(),  # Converts expiry to wall-clock
+                'data': self.data_store,
+                'expiry': self.expiry_times,
+                'sorted_sets': self.sorted_sets
+            }
+        data, deleted = {}, []
+        for k in dirty:
+            value = self.data_store.get(k, _MISSING)
+            if value is _MISSING:
+                deleted.append(k)
+            else:
+                data[k] = value
+        sorted_sets, deleted_sorted_sets = {}, []
+        for k in dirty_zsets:
+            zset = self.sorted_sets.get(k)
+            if zset is None:
+                deleted_sorted_sets.append(k)
+            else:
+                sorted_sets[k] = zset
+        return {
+            'seq': seq,
+            'clock_offset': time.time() - time.monotonic(),
+            'data': data,
+            'deleted': deleted,
+            'expiry': {k: t for k in dirty if (t := self.expiry_times.get(k)) is not None},
+            'sorted_sets': sorted_sets,
+            'deleted_sorted_sets': deleted_sorted_sets,
+        }
+
+    def _write_snapshot(self, snapshot_data: dict, prune_upto: Optional[int] = None) -> None:
+        """Publish a delta, or a base when prune_upto is given, via a temp file and rename."""
+        is_base = prune_upto is not None
+        path = self.snapshot_file if is_base else f"{self.snapshot_file}.delta.{snapshot_data['seq']}"
+        tmp_file = path + ".tmp"
+        with open(tmp_file, 'wb', buffering=SNAPSHOT_BUFFER) as f:
+            pickle.dump(snapshot_data, f, protocol=5)
+        if is_base and self._rotate_base and os.path.exists(self.snapshot_file):
+            # Keep the previous base so it can still be replayed with its deltas
+            os.replace(self.snapshot_file, self.snapshot_file + ".prev")
+        os.replace(tmp_file, path)
+        if is_base:
+            # Deltas up to the previous base are covered by both remaining bases
+            for seq, delta_file in self._delta_files():
+                if seq <= prune_upto:
+                    os.remove(delta_file)
 
     def _save_snapshot(self) -> None:
-        """Save current data store to snapshot file."""
+        """Save a base or delta snapshot without blocking requests."""
         try:
-            with self.lock:
-                snapshot_data = {
-                    'data': self.data_store,
-                    'expiry': self.expiry_times,
-                    'sorted_sets': self.sorted_sets 
-                }
-                with open(self.snapshot_file, 'w') as f:
-                    json.dump(snapshot_data, f)
-            self.last_snapshot_time = time.time()
-            logging.info("Snapshot saved successfully")
+            with self._all_locks(), self._snapshot_lock:
+                if self._snapshot_pid is not None and not self._reap_snapshot():
+                    logger.info("Snapshot already in progress")
+                    return
+                dirty, self._dirty = self._dirty, set()
+                dirty_zsets, self._dirty_zsets = self._dirty_zsets, set()
+                total = len(self.data_store) + len(self.sorted_sets)
+                is_base = (self._force_full or self._deltas_since_base >= MAX_DELTAS
+                           or len(dirty) + len(dirty_zsets) >= DELTA_RATIO * total)
+                self._snapshot_seq += 1
+                seq = self._snapshot_seq
+                if is_base:
+                    snapshot_data = self._snapshot_data(seq)
+                    prune_upto = self._base_seq
+                    self._force_full = False
+                    self._deltas_since_base = 0
+                else:
+                    snapshot_data = self._snapshot_data(seq, dirty, dirty_zsets)
+                    prune_upto = None
+                    self._deltas_since_base += 1
+
+                if hasattr(os, 'fork'):
+                    # Hold the locks only while forking; the child writes its copy-on-write view
+                    pid = os.fork()
+                    if pid == 0:
+                        try:
+                            self._write_snapshot(snapshot_data, prune_upto)
+                        except BaseException:
+                            os._exit(1)
+                        os._exit(0)
+                    self._snapshot_pid = pid
+                    self._snapshot_pending_base = seq if is_base else None
+                    self.last_snapshot_time = time.monotonic()
+                    return
+                # No fork (Windows): copy under the locks, write after releasing them
+                snapshot_data = copy.deepcopy(snapshot_data)
+            self._write_snapshot(snapshot_data, prune_upto)
+            if is_base:
+                self._base_seq = seq
+                self._rotate_base = True
+            self.last_snapshot_time = time.monotonic()
+            logger.info("Snapshot %s saved successfully", seq)
         except Exception as e:
-            logging.error(f"Error saving snapshot: {str(e)}")
+            # The dirty keys were handed to the failed snapshot, so the next one must be full
+            self._force_full = True
+            logger.error("Error saving snapshot: %s", e)
+
+    def _reap_snapshot(self) -> bool:
+        """Collect the finished snapshot child, or return False while it is still running."""
+        # Caller must hold self._snapshot_lock
+        pid, status = os.waitpid(self._snapshot_pid, os.WNOHANG)
+        if pid == 0:
+            return False
+        self._snapshot_pid = None
+        if os.waitstatus_to_exitcode(status) == 0:
+            if self._snapshot_pending_base is not None:
+                self._base_seq = self._snapshot_pending_base
+                self._rotate_base = True
+            logger.info("Snapshot saved successfully")
+        else:
+            self._force_full = True
+            logger.error("Snapshot process failed with status %s", status)
+        return True
 
     def _periodic_snapshot(self) -> None:
         """Periodically save snapshots in the background."""
         while True:
-            time.sleep(self.snapshot_interval)
-            if time.time() - self.last_snapshot_time >= self.snapshot_interval:
-                self._save_snapshot()
+            time.sleep(1)
+            if self._snapshot_pid is not None:
+                with self._snapshot_lock:
+                    if self._snapshot_pid is not None and not self._reap_snapshot():
+                        # The child is still writing, don't take the stripe locks for nothing
+                        continue
+            if time.monotonic() - self.last_snapshot_time >= self.snapshot_interval:
+                # Skip the write while nothing has changed since the last snapshot
+                if self._dirty or self._dirty_zsets or self._force_full:
+                    self._save_snapshot()
+
+    def execute_batch(self, ops: List[tuple]) -> List[Any]:
+        """Execute a list of (command, args) pairs under a single lock acquisition.
+
+        Other writers to the batch's keys wait for the whole batch, but the lock-free
+        reads (GET, EXISTS, TTL, HGET) can see it part way through.
+        """
+        results = []
+        # Take the stripes of every key in the batch up front, or all of them for KEYS/FLUSHALL
+        if any(not args or cmd in ('keys', 'flushall') for cmd, args in ops):
+            indices = range(len(self._locks))
+        else:
+            indices = {hash(args[0]) % len(self._locks) for _, args in ops}
+        with self._locked(indices):
+            for cmd, args in ops:
+                method = self._commands.get(cmd)
+                if method is None:
+                    results.append(f"Unknown command: {cmd}")
+                    continue
+                try:
+                    results.append(method(*args))
+                except Exception as e:
+                    results.append(str(e))
+        logger.info("Executed batch of %s commands", len(ops))
+        return results
 
     def set(self, key: str, value: Any, ex: Optional[int] = None) -> str:
         """Set key-value pair with optional expiry time."""
         try:
-            with self.lock:
+            with self._lock_for(key):
+                self._dirty.add(key)
                 self.data_store[key] = value
                 if ex is not None:
-                    self.expiry_times[key] = time.time() + int(ex)
-                    logging.info(f"Set key {key} with {ex} seconds TTL")
+                    self._set_expiry(key, time.monotonic() + int(ex))
+                    logger.info("Set key %s with %s seconds TTL", key, ex)
                 else:
                     # Remove any existing TTL
                     self.expiry_times.pop(key, None)
-                    logging.info(f"Set key {key} without TTL")
+                    logger.info("Set key %s without TTL", key)
                 return "OK"
         except Exception as e:
-            logging.error(f"Error setting key {key}: {str(e)}")
+            logger.error("Error setting key %s: %s", key, e)
             raise
 
     def get(self, key: str) -> Optional[Any]:
-        """Get value for key with error handling."""
+        """Get value for key with error handling. Lock-free unless the key looks expired."""
         try:
-            with self.lock:
-                if key in self.expiry_times:
-                    if time.time() >= self.expiry_times[key]:
-                        self.data_store.pop(key, None)
-                        self.expiry_times.pop(key)
-                        return None
-                value = self.data_store.get(key)
-                if value is None:
-                    logging.info(f"Key not found: {key}")
-                return value
+            expire_at = self.expiry_times.get(key)
+            if expire_at is None or time.monotonic() < expire_at:
+                return self.data_store.get(key)
+            with self._lock_for(key):
+                expire_at = self.expiry_times.get(key)
+                if expire_at is not None and time.monotonic() >= expire_at:
+                    self.data_store.pop(key, None)
+                    del self.expiry_times[key]
+                    self._dirty.add(key)
+                    return None
+                return self.data_store.get(key)
         except Exception as e:
-            logging.error(f"Error getting key {key}: {str(e)}")
+            logger.error("Error getting key %s: %s", key, e)
             raise
 
     def delete(self, key: str) -> Optional[Any]:
         """Delete key with error handling."""
         try:
-            with self.lock:
+            with self._lock_for(key):
+                self._dirty.add(key)
                 value = self.data_store.pop(key, None)
                 self.expiry_times.pop(key, None)
                 if value is not None:
-                    logging.info(f"Deleted key: {key}")
+                    logger.info("Deleted key: %s", key)
                 return value
         except Exception as e:
-            logging.error(f"Error deleting key {key}: {str(e)}")
+            logger.error("Error deleting key %s: %s", key, e)
             raise
 
     def keys(self) -> list:
         """Get all keys with error handling."""
         try:
-            with self.lock:
+            with self._all_locks():
                 # Only return non-expired keys
-                current_time = time.time()
+                current_time = time.monotonic()
+                expiry_times = self.expiry_times
                 return [
-                    key for key in self.data_store.keys()
-                    if key not in self.expiry_times or self.expiry_times[key] > current_time
+                    key for key in self.data_store
+                    if expiry_times.get(key, inf) > current_time
                 ]
         except Exception as e:
-            logging.error(f"Error getting keys: {str(e)}")
+            logger.error("Error getting keys: %s", e)
             raise
 
     def flushall(self) -> str:
         """Clear all data with error handling."""
         try:
-            with self.lock:
+            with self._all_locks():
                 self.data_store.clear()
                 self.expiry_times.clear()
-                self._save_snapshot()  # Save empty state
-                logging.info("Executed FLUSHALL command")
+                with self._expiry_changed:
+                    self._ttl_heap.clear()
+                    self._ttl_buckets.clear()
+                    self._ttl_bucket_entries = 0
+                # Every key changed, the snapshot thread writes the empty state as a new base
+                self._force_full = True
+                logger.info("Executed FLUSHALL command")
                 return "OK"
         except Exception as e:
-            logging.error(f"Error in FLUSHALL: {str(e)}")
+            logger.error("Error in FLUSHALL: %s", e)
             raise
 
     def append(self, key: str, value: str) -> Any:
         """Append to string value with type checking and error handling."""
         try:
-            with self.lock:
-                if key in self.data_store:
-                    if isinstance(self.data_store[key], str):
-                        self.data_store[key] += value
-                        logging.info(f"Appended to key: {key}")
-                        return len(self.data_store[key])
+            with self._lock_for(key):
+                self._dirty.add(key)
+                current = self.data_store.get(key, _MISSING)
+                if current is not _MISSING:
+                    if type(current) is str:
+                        current += value
+                        self.data_store[key] = current
+                        logger.info("Appended to key: %s", key)
+                        return len(current)
                     else:
                         msg = f"Value for key {key} is not a string"
-                        logging.warning(msg)
+                        logger.warning(msg)
                         return msg
                 else:
                     msg = f"Key {key} does not exist"
-                    logging.warning(msg)
+                    logger.warning(msg)
                     return msg
         except Exception as e:
-            logging.error(f"Error appending to key {key}: {str(e)}")
+            logger.error("Error appending to key %s: %s", key, e)
             raise
 
     def expire(self, key: str, seconds: int) -> bool:
         """Set TTL (time to live) for a key."""
         try:
-            with self.lock:
+            with self._lock_for(key):
+                self._dirty.add(key)
                 if key in self.data_store:
-                    self.expiry_times[key] = time.time() + int(seconds)
-                    logging.info(f"Set TTL for key {key}: {seconds} seconds")
+                    self._set_expiry(key, time.monotonic() + int(seconds))
+                    logger.info("Set TTL for key %s: %s seconds", key, seconds)
                     return True
-                logging.info(f"Key {key} not found for expire")
+                logger.info("Key %s not found for expire", key)
                 return False
         except Exception as e:
-            logging.error(f"Error setting expire for key {key}: {str(e)}")
+            logger.error("Error setting expire for key %s: %s", key, e)
             raise
 
     def ttl(self, key: str) -> int:
-        """Get remaining TTL (time to live) for a key."""
+        """Get remaining TTL (time to live) for a key. Lock-free unless the key looks expired."""
         try:
-            with self.lock:
-                if key not in self.data_store:
-                    logging.info(f"Key {key} not found for TTL check")
+            # Lock-free fast path for keys that are missing, persistent or still live
+            if key not in self.data_store:
+                logger.info("Key %s not found for TTL check", key)
+                return -2
+            expire_at = self.expiry_times.get(key)
+            if expire_at is None:
+                logger.info("Key %s has no TTL set", key)
+                return -1
+            remaining = int(expire_at - time.monotonic())
+            if remaining > 0:
+                return remaining
+            with self._lock_for(key):
+                data_store = self.data_store
+                expiry_times = self.expiry_times
+                if key not in data_store:
+                    logger.info("Key %s not found for TTL check", key)
                     return -2  # Key không tồn tại
                 
-                if key not in self.expiry_times:
-                    logging.info(f"Key {key} has no TTL set")
+                expire_at = expiry_times.get(key)
+                if expire_at is None:
+                    logger.info("Key %s has no TTL set", key)
                     return -1  # Key không có TTL
                 
-                remaining = int(self.expiry_times[key] - time.time())
+                remaining = int(expire_at - time.monotonic())
                 if remaining <= 0:
                     # Key đã hết hạn
-                    self.data_store.pop(key, None)
-                    self.expiry_times.pop(key, None)
-                    logging.info(f"Key {key} expired during TTL check")
+                    data_store.pop(key, None)
+                    del expiry_times[key]
+                    self._dirty.add(key)
+                    logger.info("Key %s expired during TTL check", key)
                     return -2
                     
                 return remaining
         except Exception as e:
-            logging.error(f"Error checking TTL for key {key}: {str(e)}")
+            logger.error("Error checking TTL for key %s: %s", key, e)
             raise
 
     def persist(self, key: str) -> bool:
         """Remove TTL from a key."""
         try:
-            with self.lock:
+            with self._lock_for(key):
+                self._dirty.add(key)
                 if key not in self.data_store:
-                    logging.info(f"Key {key} not found for persist")
+                    logger.info("Key %s not found for persist", key)
                     return False
                     
-                if key not in self.expiry_times:
-                    logging.info(f"Key {key} already has no TTL")
+                if self.expiry_times.pop(key, None) is None:
+                    logger.info("Key %s already has no TTL", key)
                     return False
                     
-                self.expiry_times.pop(key)
-                logging.info(f"Removed TTL for key {key}")
+                logger.info("Removed TTL for key %s", key)
                 return True
         except Exception as e:
-            logging.error(f"Error persisting key {key}: {str(e)}")
+            logger.error("Error persisting key %s: %s", key, e)
             raise
 
         #  Hash 
     def hset(self, hash_key: str, field: str, value: Any) -> str:   
         """Set a field in a hash stored at hash_key"""
         try:
-            with self.lock:
-                if hash_key not in self.data_store:
-                    self.data_store[hash_key] = {}
-                self.data_store[hash_key][field] = value
-                logging.info(f"Set {field} in hash {hash_key}: {value}")
+            with self._lock_for(hash_key):
+                self._dirty.add(hash_key)
+                data_store = self.data_store
+                hash_data = data_store.get(hash_key)
+                if hash_data is None:
+                    hash_data = data_store[hash_key] = RHash()
+                elif type(hash_data) is not RHash:
+                    raise TypeError(f"Key '{hash_key}' does not hold a hash.")
+                hash_data[field] = value
+                logger.info("Set %s in hash %s: %s", field, hash_key, value)
                 return "OK"
         except Exception as e:
-            logging.error(f"Error in HSET {hash_key}: {str(e)}")
+            logger.error("Error in HSET %s: %s", hash_key, e)
             raise
 
     def hget(self, hash_key: str, field: str) -> Optional[Any]:
-        """Get value of a field from hash stored at hash_key"""
+        """Get value of a field from hash stored at hash_key. Reads without the stripe lock."""
         try:
-            with self.lock:
-                hash_data = self.data_store.get(hash_key, {})
-                value = hash_data.get(field)
-                if value is None:
-                    logging.info(f"Field {field} not found in hash {hash_key}")
-                return value
+            try:
+                hash_data = self.data_store[hash_key]
+            except KeyError:
+                return None
+            return hash_data.get(field)
         except Exception as e:
-            logging.error(f"Error in HGET {hash_key}: {str(e)}")
+            logger.error("Error in HGET %s: %s", hash_key, e)
             raise
 
     def hdel(self, hash_key: str, field: str) -> bool:
         """Delete a field from hash stored at hash_key"""
         try:
-            with self.lock:
-                hash_data = self.data_store.get(hash_key, {})
-                if field in hash_data:
-                    del hash_data[field]
-                    logging.info(f"Deleted field {field} from hash {hash_key}")
+            with self._lock_for(hash_key):
+                self._dirty.add(hash_key)
+                try:
+                    hash_data = self.data_store[hash_key]
+                except KeyError:
+                    hash_data = {}
+                if hash_data.pop(field, _MISSING) is not _MISSING:
+                    logger.info("Deleted field %s from hash %s", field, hash_key)
                     return True
-                logging.info(f"Field {field} not found in hash {hash_key}")
+                logger.info("Field %s not found in hash %s", field, hash_key)
                 return False
         except Exception as e:
-            logging.error(f"Error in HDEL {hash_key}: {str(e)}")
+            logger.error("Error in HDEL %s: %s", hash_key, e)
             raise
 
     def hgetall(self, hash_key: str) -> dict:
         """Get all fields and values of hash stored at hash_key"""
         try:
-            with self.lock:
-                hash_data = self.data_store.get(hash_key, {})
-                return hash_data
+            with self._lock_for(hash_key):
+                try:
+                    return self.data_store[hash_key]
+                except KeyError:
+                    return {}
         except Exception as e:
-            logging.error(f"Error in HGETALL {hash_key}: {str(e)}")
+            logger.error("Error in HGETALL %s: %s", hash_key, e)
             raise
 
     def hdelall(self, hash_key: str) -> bool:
         """Delete all field in hash"""
         try:
-            with self.lock:
-                if hash_key in self.data_store:
-                    self.data_store.pop(hash_key)
-                    logging.info(f"Deleted all fields from hash {hash_key}")
+            with self._lock_for(hash_key):
+                self._dirty.add(hash_key)
+                if self.data_store.pop(hash_key, _MISSING) is not _MISSING:
+                    logger.info("Deleted all fields from hash %s", hash_key)
                     return True
-                logging.info(f"Hash {hash_key} does not exist")
+                logger.info("Hash %s does not exist", hash_key)
                 return False
         except Exception as e:
-            logging.error(f"Error in HDELALL {hash_key}: {str(e)}")
+            logger.error("Error in HDELALL %s: %s", hash_key, e)
             raise
     # End Hash
 
@@ -313,146 +752,179 @@ class FaultTolerantRedisClone:
     def zset(self, zset_key: str, score: float, value: Any) -> int:
         """Add elements to Sorted Set with scores"""
         try:
-            with self.lock:
-                if zset_key not in self.sorted_sets:
-                    self.sorted_sets[zset_key] = []
+            with self._lock_for(zset_key):
+                score = float(score)
+                if not isfinite(score):
+                    # NaN has no order and would corrupt the SortedList, and neither
+                    # NaN nor infinity can be sent back as JSON
+                    raise ValueError(f"ZSET score is not a valid finite float: {score}")
+                self._dirty_zsets.add(zset_key)
+                sorted_sets = self.sorted_sets
+                zset_scores = self.zset_scores
+                zset = sorted_sets.get(zset_key)
+                if zset is None:
+                    zset = sorted_sets[zset_key] = SortedList()
+                    scores = zset_scores[zset_key] = {}
+                else:
+                    scores = zset_scores[zset_key]
+                # A value appears once per set, so re-adding it only updates its score
+                old_score = scores.get(value)
+                if old_score is not None:
+                    # The list changes first, so a failure never leaves scores ahead of it
+                    zset.remove((old_score, value))
+                    del scores[value]
                 # Add elements to the Sorted Set, (score, value) is a tuple pair
-                self.sorted_sets[zset_key].append((score, value))
-                # sort
-                self.sorted_sets[zset_key].sort()
-                logging.info(f"Added value {value} with score {score} to ZSET {zset_key}")
-                return 1  
+                zset.add((score, value))
+                scores[value] = score
+                logger.info("Added value %s with score %s to ZSET %s", value, score, zset_key)
+                return 0 if old_score is not None else 1
         except Exception as e:
-            logging.error(f"Error in ZADD {zset_key}: {str(e)}")
+            logger.error("Error in ZADD %s: %s", zset_key, e)
             raise
 
     def zrange(self, zset_key: str, start: int, end: int) -> List[Any]:
         """Gets the elements in the Sorted Set from zset_key, according to the specified range"""
         try:
-            with self.lock:
-                if zset_key in self.sorted_sets:
-                    start = int(start)
-                    end = int(end)
+            with self._lock_for(zset_key):
+                zset = self.sorted_sets.get(zset_key)
+                if zset is not None:
+                    start, stop = self._rank_range(len(zset), int(start), int(end))
                     # Get the range of elements in the sorted set
-                    zset = self.sorted_sets[zset_key]
-                    return [value for _ , value in zset[start:end+1]]
-                logging.warning(f"ZSET {zset_key} không tồn tại.")
+                    return list(map(itemgetter(1), zset.islice(start, stop)))
+                logger.warning("ZSET %s không tồn tại.", zset_key)
                 return []
         except Exception as e:
-            logging.error(f"Error in ZRANGE {zset_key}: {str(e)}")
+            logger.error("Error in ZRANGE %s: %s", zset_key, e)
             raise
 
     def zrevrange(self, zset_key: str, start: int, end: int) -> List[Any]:
         """Get elements from the Sorted Set, sort them in descending order by score"""
         try:
-            with self.lock:
-                if zset_key in self.sorted_sets:
-                    start = int(start)
-                    stop = int(stop)
-                    # Gets the range of elements in the sorted set in descending order
-                    zset = self.sorted_sets[zset_key]
-                    return [value for score, value in reversed(zset[start:end+1])]
-                logging.warning(f"ZSET {zset_key} không tồn tại.")
+            with self._lock_for(zset_key):
+                zset = self.sorted_sets.get(zset_key)
+                if zset is not None:
+                    n = len(zset)
+                    start, stop = self._rank_range(n, int(start), int(end))
+                    # Rank 0 is the highest score, so walk the mirrored ascending slice backwards
+                    return list(map(itemgetter(1), zset.islice(n - stop, n - start, reverse=True)))
+                logger.warning("ZSET %s không tồn tại.", zset_key)
                 return []
         except Exception as e:
-            logging.error(f"Error in ZREVRANGE {zset_key}: {str(e)}")
+            logger.error("Error in ZREVRANGE %s: %s", zset_key, e)
             raise
 
     def zdelvalue(self, zset_key: str, value: Any) -> int:
         """Delete elements in the Sorted Set"""
         try:
-            with self.lock:
-                if zset_key in self.sorted_sets:
+            with self._lock_for(zset_key):
+                self._dirty_zsets.add(zset_key)
+                zset = self.sorted_sets.get(zset_key)
+                if zset is not None:
                     # Find and remove elements from the Sorted Set
-                    zset = self.sorted_sets[zset_key]
-                    self.sorted_sets[zset_key] = [item for item in zset if item[1] != value]
-                    logging.info(f"Removed value {value} from ZSET {zset_key}")
+                    scores = self.zset_scores[zset_key]
+                    score = scores.get(value)
+                    if score is None:
+                        logger.info("Value %s not found in ZSET %s", value, zset_key)
+                        return 0
+                    zset.remove((score, value))
+                    del scores[value]
+                    logger.info("Removed value %s from ZSET %s", value, zset_key)
                     return 1  
-                logging.warning(f"ZSET {zset_key} không tồn tại.")
+                logger.warning("ZSET %s không tồn tại.", zset_key)
                 return 0
         except Exception as e:
-            logging.error(f"Error in ZREM {zset_key}: {str(e)}")
+            logger.error("Error in ZREM %s: %s", zset_key, e)
             raise
 
     def zdelkey(self, zset_key: str) -> int:
         """Delete the entire Sorted Set identified by zset_key"""
         try:
-            with self.lock:
-                if zset_key in self.sorted_sets:
-                    del self.sorted_sets[zset_key]  # Delete the entire ZSET
-                    logging.info(f"Deleted entire ZSET {zset_key}")
+            with self._lock_for(zset_key):
+                self._dirty_zsets.add(zset_key)
+                if self.sorted_sets.pop(zset_key, None) is not None:  # Delete the entire ZSET
+                    del self.zset_scores[zset_key]
+                    logger.info("Deleted entire ZSET %s", zset_key)
                     return 1  # Return 1 to indicate successful deletion
-                logging.warning(f"ZSET {zset_key} không tồn tại.")
+                logger.warning("ZSET %s không tồn tại.", zset_key)
                 return 0  # Return 0 if ZSET doesn't exist
         except Exception as e:
-            logging.error(f"Error in ZDEL {zset_key}: {str(e)}")
+            logger.error("Error in ZDEL %s: %s", zset_key, e)
             raise
 
 
     def zrank(self, zset_key: str, value: Any) -> Optional[int]:
         """Check the position of an element in the Sorted Set"""
         try:
-            with self.lock:
-                if zset_key in self.sorted_sets:
-                    zset = self.sorted_sets[zset_key]
-                    for idx, (score, item) in enumerate(zset):
-                        if item == value:
-                            logging.info(f"Rank of {value} in ZSET {zset_key}: {idx}")
-                            return idx
-                logging.warning(f"Value {value} not found in ZSET {zset_key}")
+            with self._lock_for(zset_key):
+                scores = self.zset_scores.get(zset_key)
+                if scores is not None:
+                    score = scores.get(value)
+                    if score is not None:
+                        # Binary search on the (score, value) pair
+                        idx = self.sorted_sets[zset_key].index((score, value))
+                        logger.info("Rank of %s in ZSET %s: %s", value, zset_key, idx)
+                        return idx
+                logger.warning("Value %s not found in ZSET %s", value, zset_key)
                 return None
         except Exception as e:
-            logging.error(f"Error in ZRANK {zset_key}: {str(e)}")
+            logger.error("Error in ZRANK %s: %s", zset_key, e)
             raise
 
     def zgetall(self, zset_key: str) -> List[tuple]:
         """Get all the elements in the Sorted Set"""
         try:
-            with self.lock:
-                if zset_key in self.sorted_sets:
-                    return self.sorted_sets[zset_key]
-                logging.warning(f"ZSET {zset_key} không tồn tại.")
+            with self._lock_for(zset_key):
+                zset = self.sorted_sets.get(zset_key)
+                if zset is not None:
+                    return list(zset)
+                logger.warning("ZSET %s không tồn tại.", zset_key)
                 return []
         except Exception as e:
-            logging.error(f"Error in ZGETALL {zset_key}: {str(e)}")
+            logger.error("Error in ZGETALL %s: %s", zset_key, e)
             raise
     # End Sorted sets
 
     # Start List
     def _get_list(self, key):   
         """Helper method to get a list from the data store."""
-        if key not in self.data_store:
-            self.data_store[key] = []
-        elif not isinstance(self.data_store[key], list):
+        data_store = self.data_store
+        lst = data_store.get(key)
+        if lst is None:
+            lst = data_store[key] = RList()
+            self._dirty.add(key)
+        elif type(lst) is not RList:
             raise TypeError(f"Key '{key}' does not hold a list.")
-        return self.data_store[key]
+        return lst
     
     def lpush(self, key, *values):
         """Push values to the head of the list."""
-        with self.lock_list:
+        with self._lock_for(key):
+            self._dirty.add(key)
             lst = self._get_list(key)
-            for value in reversed(values):  # Maintain LPUSH semantics
-                lst.insert(0, value)
+            lst.extendleft(reversed(values))  # Maintain LPUSH semantics
         return len(lst)
 
     def rpush(self, key, *values):
         """Push values to the tail of the list."""
-        with self.lock_list:
+        with self._lock_for(key):
+            self._dirty.add(key)
             lst = self._get_list(key)
             lst.extend(values)
         return len(lst)
 
     def lpop(self, key):
         """Pop a value from the head of the list."""
-        with self.lock_list:
+        with self._lock_for(key):
+            self._dirty.add(key)
             lst = self._get_list(key)
             if not lst:
                 return None
-            return lst.pop(0)
+            return lst.popleft()
 
     def rpop(self, key):
         """Pop a value from the tail of the list."""
-        with self.lock_list:
+        with self._lock_for(key):
+            self._dirty.add(key)
             lst = self._get_list(key)
             if not lst:
                 return None
@@ -460,16 +932,16 @@ class FaultTolerantRedisClone:
 
     def lrange(self, key, start, stop):
         """Get a subrange from the list."""
-        with self.lock_list:
+        with self._lock_for(key):
             lst = self._get_list(key)
-            start = int(start)
-            stop = int(stop)
-            return lst[start:stop + 1]
+            # islice needs non-negative bounds
+            start, stop = self._rank_range(len(lst), int(start), int(stop))
+            return list(islice(lst, start, stop))
 
 
     def llen(self, key):
         """Get the length of the list."""
-        with self.lock_list:
+        with self._lock_for(key):
             lst = self._get_list(key)
             return len(lst)
         
@@ -477,7 +949,8 @@ class FaultTolerantRedisClone:
         """
         Delete the entire key and push new values to a list (head by default).
         """
-        with self.lock_list:
+        with self._lock_for(key):
+            self._dirty.add(key)
             # Remove the existing key if it exists
             self.data_store.pop(key, None)
 
@@ -487,21 +960,25 @@ class FaultTolerantRedisClone:
 
 
     def exists(self, key: str) -> bool:
+        """Check whether key exists. Lock-free unless the key looks expired."""
         try:
-            with self.lock:
-                logging.info(f"Checking existence of key: {key}") 
-                if key in self.data_store:
+            expire_at = self.expiry_times.get(key)
+            if expire_at is None or time.monotonic() < expire_at:
+                return key in self.data_store
+            with self._lock_for(key):
+                data_store = self.data_store
+                expiry_times = self.expiry_times
+                if key in data_store:
                     # Check if the key has expired
-                    if key in self.expiry_times and self.expiry_times[key] <= time.time():
+                    expire_at = expiry_times.get(key)
+                    if expire_at is not None and expire_at <= time.monotonic():
                         # If it has expired, delete the key from data_store and Expiration_times
-                        self.data_store.pop(key, None)
-                        self.expiry_times.pop(key, None)
-                        logging.info(f"Key {key} is expired and removed.")
+                        data_store.pop(key, None)
+                        del expiry_times[key]
+                        self._dirty.add(key)
                         return False
-                    logging.info(f"Key {key} exists and is valid.")
                     return True
-                logging.info(f"Key {key} does not exist.")
                 return False
         except Exception as e:
-            logging.error(f"Error checking existence of key {key}: {str(e)}")
+            logger.error("Error checking existence of key %s: %s", key, e)
             raise
@@ -1,10 +1,56 @@
 # Needed imports
 import json
+import math
+import logging
 import socket
 import inspect
-from threading import Thread
+import asyncio
+from collections import deque
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 65536
+BUFFER_POOL_SIZE = 64  # Receive buffers kept for reuse across connections
+
+# JSON codec for the wire protocol, C-accelerated through orjson when it is installed.
+# The json fallback follows orjson's rules so replies do not depend on the import:
+# no NaN/Infinity, and integers outside the 64-bit range decode as floats.
+def _encode(obj) -> bytes:
+    # default=list sends deques and other iterables as arrays
+    if orjson is not None:
+        return orjson.dumps(obj, default=list, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=list, allow_nan=False).encode()
+
+def _parse_int(text: str):
+    value = int(text)
+    return value if -2**63 <= value < 2**64 else float(value)
+
+def _parse_float(text: str) -> float:
+    value = float(text)
+    if math.isinf(value):
+        raise ValueError(f'Number {text} is infinity when parsed as double')
+    return value
+
+def _parse_constant(text: str):
+    raise ValueError(f'Invalid JSON constant {text}')
+
+def _decode(data):
+    # data may be a memoryview into the receive buffer
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data), parse_int=_parse_int, parse_float=_parse_float,
+                      parse_constant=_parse_constant)
 
-SIZE = 1024
 # rpc.py
 class RPCServer:
     def __init__(self, host:str='127.0.0.1', port:int=8080) -> None:
@@ -12,6 +58,8 @@ class RPCServer:
         self.port = port
         self.address = (host, port)
         self._methods = {}
+        # Receive buffers reclaimed from closed connections; only the event loop thread touches it
+        self._buffer_pool = deque()
 
         # Within RPCServer
     def registerMethod(self, function) -> None:
@@ -32,49 +80,137 @@ class RPCServer:
                 'A non class object has been passed into RPCServer.registerInstance(self, instance)')
 
         # Withing RPCServer
-    def __handle__(self, client: socket.socket, address: tuple) -> None:
-        print(f'Managing requests from {address}.')
-        while True:
-            try:
-                functionName, args, kwargs = json.loads(client.recv(SIZE).decode())
-            except:
-                print(f'! Client {address} disconnected.')
-                break
-            # Showing request Type
-            print(f'> {address} : {functionName}({args})')
-
-            try:
-                response = self._methods[functionName](*args, **kwargs)
-            except Exception as e:
-                # Send back exeption if function called by client is not registred
-                client.sendall(json.dumps(str(e)).encode())
-            else:
-                client.sendall(json.dumps(response).encode())
+    def __handle__(self, request, address: tuple):
+        """Run one encoded request and return the encoded reply, or None if it is malformed."""
+        try:
+            functionName, args, kwargs = _decode(request)
+        except:
+            return None
+        # Showing request Type; a debug record is only formatted when debug logging is on
+        logger.debug("> %s : %s(%s)", address, functionName, args)
 
-        print(f'Completed requests from {address}.')
-        client.close()
+        try:
+            return _encode(self._methods[functionName](*args, **kwargs))
+        except Exception as e:
+            # Send back exeption if function called by client is not registred
+            return _encode(str(e))
+
+    # Within RPCServer
+    def _acquire_buffer(self) -> bytearray:
+        return self._buffer_pool.pop() if self._buffer_pool else bytearray(READ_SIZE)
+
+    # Within RPCServer
+    def _release_buffer(self, buffer: bytearray) -> None:
+        # Buffers beyond the cap are left to the garbage collector
+        if len(self._buffer_pool) < BUFFER_POOL_SIZE:
+            self._buffer_pool.append(buffer)
 
     # within RPCServer
-    def run(self) -> None:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.bind(self.address)
-            sock.listen()
+    async def __serve__(self) -> None:
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: _RPCConnection(self), self.host, self.port)
 
-            print(f'+ Server {self.address} running')
-            while True:
-                try:
-                    client, address = sock.accept()
+        print(f'+ Server {self.address} running')
+        async with server:
+            await server.serve_forever()
 
-                    Thread(target=self.__handle__, args=[client, address]).start()
+    # within RPCServer
+    def run(self) -> None:
+        try:
+            if uvloop is not None:
+                uvloop.run(self.__serve__())
+            else:
+                asyncio.run(self.__serve__())
+        except KeyboardInterrupt:
+            print(f'- Server {self.address} interrupted')
 
-                except KeyboardInterrupt:
-                    print(f'- Server {self.address} interrupted')
-                    break
+# in rpc.py
+class _RPCConnection(asyncio.BufferedProtocol):
+    """One client connection; the event loop reads straight into a pooled buffer."""
+    def __init__(self, server: RPCServer) -> None:
+        self._server = server
+        self._transport = None
+        self._address = None
+        self._buffer = None
+        self._pending = bytearray()  # Start of a request split across reads
+        self._responses = []
+
+    def connection_made(self, transport) -> None:
+        self._transport = transport
+        self._address = transport.get_extra_info('peername')
+        self._buffer = self._server._acquire_buffer()
+        print(f'Managing requests from {self._address}.')
+
+    def get_buffer(self, sizehint: int) -> bytearray:
+        return self._buffer
+
+    def buffer_updated(self, nbytes: int) -> None:
+        buffer = self._buffer
+        view = memoryview(buffer)[:nbytes]
+        pending = self._pending
+        responses = self._responses
+        start = 0
+        if pending:
+            # pending never holds a newline, so only the new bytes are scanned
+            end = buffer.find(b'\n', 0, nbytes)
+            if end < 0:
+                pending += view
+                return
+            pending += view[:end]
+            connected = self._dispatch(pending)
+            pending.clear()
+            start = end + 1
+        else:
+            connected = True
+
+        # Requests are newline-delimited; run every complete one received so far
+        while connected:
+            end = buffer.find(b'\n', start, nbytes)
+            if end < 0:
+                pending += view[start:]
+                break
+            connected = self._dispatch(view[start:end])
+            start = end + 1
+
+        # One write for the whole pipelined block
+        if responses:
+            responses.append(b'')
+            self._transport.write(b'\n'.join(responses))
+            responses.clear()
+        if not connected:
+            # Closed only after the replies queued before the bad request are written
+            print(f'! Client {self._address} disconnected.')
+            self._transport.close()
+
+    def _dispatch(self, request) -> bool:
+        """Queue the reply to one request, returning False if it is malformed."""
+        response = self._server.__handle__(request, self._address)
+        if response is None:
+            return False
+        self._responses.append(response)
+        return True
+
+    def eof_received(self) -> bool:
+        print(f'! Client {self._address} disconnected.')
+        return False
+
+    def connection_lost(self, exc) -> None:
+        self._server._release_buffer(self._buffer)
+        self._buffer = None
+        print(f'Completed requests from {self._address}.')
+
+    # Stop reading while the client is not consuming replies
+    def pause_writing(self) -> None:
+        self._transport.pause_reading()
+
+    def resume_writing(self) -> None:
+        self._transport.resume_reading()
 
 # in rpc.py
 class RPCClient:
     def __init__(self, host:str='localhost', port:int=8080) -> None:
         self.__sock = None
+        self.__stream = None
         self.__address = (host, port)
 
     # Within RPCClient
@@ -82,22 +218,32 @@ class RPCClient:
         try:
             self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.__sock.connect(self.__address)
+            self.__stream = self.__sock.makefile('rb')
         except EOFError as e:
             print(e)
             raise Exception('Client was not able to connect.')
 
     def disconnect(self):
         try:
+            self.__stream.close()
             self.__sock.close()
         except:
             pass
 
+        # Within RPCClient
+    def batch(self, ops) -> list:
+        # Pipeline several calls: send every request in one write, then read all replies
+        payload = b''.join(_encode((name, args, {})) + b'\n' for name, args in ops)
+        self.__sock.sendall(payload)
+
+        return [_decode(self.__stream.readline()) for _ in ops]
+
         # Within RPCClient
     def __getattr__(self, __name: str):
         def excecute(*args, **kwargs):
-            self.__sock.sendall(json.dumps((__name, args, kwargs)).encode())
+            self.__sock.sendall(_encode((__name, args, kwargs)) + b'\n')
 
-            response = json.loads(self.__sock.recv(SIZE).decode())
+            response = _decode(self.__stream.readline())
 
             return response
 